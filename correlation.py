@@ -7,10 +7,15 @@ The module also features a command line interface which enables saving
 the results to an HTML file.
 """
 
-import pandas as pd
+import numpy as np
+import os
 
 from argparse import ArgumentParser
 from pathlib import Path
+from matplotlib import colormaps
+from matplotlib.colors import to_hex
+
+from dataset import load_data, split_by_room, COLUMNS
 
 # Public API declaration
 __all__ = ['get_corrs', 'INPUT_FILE', 'OUTPUT_FILE', 'MPL_COLORMAP', 'PRECISION']
@@ -20,6 +25,10 @@ OUTPUT_FILE = 'data/correlations.html'
 MPL_COLORMAP = 'Greens'
 PRECISION = 6
 _HTML_TITLE = 'Wi-fi signal strength correlation values.'
+_HTML_STYLE = 'tr, td, caption {padding: 10px;} caption {font-weight: bold;}'
+# Cells whose background luminance is below the threshold get light text
+# (the same rule and threshold as pandas' Styler.background_gradient)
+_TEXT_COLOR_THRESHOLD = 0.408
 
 def corr_to_html(data_file: str = INPUT_FILE,
                  colormap: str = MPL_COLORMAP,
@@ -33,7 +42,9 @@ def corr_to_html(data_file: str = INPUT_FILE,
 
     data_file: a CSV-file containing the raw data of the Wi-Fi Localization project.
 
-    colormap: matplotlib color map to use as a heat map for each table.
+    colormap: matplotlib color map to use as a heat map for each table. The heat map
+    spans the range of possible values (from -1 to 1, or from 0 to 1 if 'absolute' is True),
+    so that the colours are comparable across the tables.
 
     precision: the floating point precision to format float values (the default values for
     the abovementioned parameters are specified as the module's constants).
@@ -43,36 +54,94 @@ def corr_to_html(data_file: str = INPUT_FILE,
     Returns: the HTML string.
     """
 
-    if not Path(data_file).is_file():
-        raise FileNotFoundError(f'File {data_file} can not be found.')
-    
-    df = pd.read_csv(data_file,
-                     sep = '\t',
-                     header = None,
-                     names  = ['d' + str(i) for i in range(1, 8)] + ['room'],
-                     )
+    devices = COLUMNS[:-1]
+    rooms, signals, offsets = split_by_room(load_data(data_file))
+
+    corrs = _room_corrs(signals.astype(float), offsets)
+    if absolute:
+        np.abs(corrs, out=corrs)
 
-    df = df.groupby('room').corr().abs() if absolute else df.groupby('room').corr()
+    # The colour scale spans the whole range of correlation values, rather than
+    # each table's own minimum and maximum, so the heat maps are comparable across
+    # rooms. All the cells of all the tables are mapped to colours in one call.
+    vmin, vmax = (0.0, 1.0) if absolute else (-1.0, 1.0)
+    colors = colormaps[colormap]((corrs - vmin) / (vmax - vmin))
 
     html = [f'<!DOCTYPE html><html lang="en"><head><title>{_HTML_TITLE}'
-            '</title></head><body style="background-color: '
+            f'</title><style>{_HTML_STYLE}</style></head><body style="background-color: '
             f'#f2f2f2;"><article><h1>{_HTML_TITLE}</h1>']
 
-    for i in df.index.get_level_values(0).unique():
-        html.append(
-            df.loc[i].style
-            .set_caption(f'ROOM {i}')
-            .set_table_styles([{'selector' : 'tr, td, caption', 'props' : 'padding: 10px;'},
-                               {'selector' : 'caption', 'props' : 'font-weight: bold'},        
-                               ])
-            .format(precision = precision)
-            .background_gradient(axis=None, cmap=colormap)
-            .to_html()
-            )
+    for i, corr, rgba in zip(rooms, corrs, colors):
+        html.append(_corr_to_table(corr, rgba, f'ROOM {i}', devices, precision))
 
     html.append('</article></body></html>')
 
     return '<br><br>'.join(html)
+
+def _room_corrs(signals: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Returns the Pearson correlation matrices of the columns of 'signals' for each
+    slab of rows delimited by 'offsets', as an array of shape (rooms, devices, devices).
+    """
+
+    sizes = np.diff(offsets)
+    n_rooms, n_devices = len(sizes), signals.shape[1]
+
+    # Centre each room's slab and take its X.T @ X product. If all the rooms have
+    # the same number of rows (as in this dataset), the slabs are stacked into a
+    # (rooms, rows, devices) tensor and all the products are taken in one call.
+    if (sizes == sizes[0]).all():
+        x = signals.reshape(n_rooms, sizes[0], n_devices)
+        xc = x - x.mean(axis=1, keepdims=True)
+        corrs = np.einsum('rki,rkj->rij', xc, xc, optimize=True)
+    else:
+        corrs = np.empty((n_rooms, n_devices, n_devices))
+        for r, c in enumerate(corrs):
+            xc = signals[offsets[r]:offsets[r + 1]]
+            xc = xc - xc.mean(axis=0)
+            np.dot(xc.T, xc, out=c)
+
+    # Scale the rows and columns of each matrix by 1/sqrt(diag). A device with a
+    # constant signal in a room has a zero variance, and its correlations are NaN.
+    d = np.sqrt(np.einsum('rii->ri', corrs))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corrs /= d[:, :, None]
+        corrs /= d[:, None, :]
+
+    return corrs
+
+def _corr_to_table(corr: np.ndarray,
+                   rgba: np.ndarray,
+                   caption: str,
+                   devices: list[str],
+                   precision: int) -> str:
+    """Returns an HTML table for the correlation matrix 'corr' of one room,
+    with the cells coloured as a heat map with the RGBA colours in 'rgba'.
+    Cells with non-finite values (NaN) are left uncoloured.
+    """
+
+    # Relative luminance of the background colours, to pick the text colour
+    rgb = rgba[..., :3]
+    rgb = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    text_colors = np.where(rgb @ [0.2126, 0.7152, 0.0722] < _TEXT_COLOR_THRESHOLD,
+                           '#f1f1f1', '#000000')
+
+    rows = [f'<table><caption>{caption}</caption><thead><tr><th></th>'
+            + ''.join(f'<th>{device}</th>' for device in devices)
+            + '</tr></thead><tbody>']
+
+    for device, values, colors, texts in zip(devices, corr, rgba, text_colors):
+        rows.append(
+            f'<tr><th>{device}</th>'
+            + ''.join(f'<td style="background-color: {to_hex(color)}; '
+                      f'color: {text};">{value:.{precision}f}</td>'
+                      if np.isfinite(value) else f'<td>{value:.{precision}f}</td>'
+                      for value, color, text in zip(values, colors, texts))
+            + '</tr>'
+            )
+
+    rows.append('</tbody></table>')
+
+    return ''.join(rows)
     
 
 # CLI
@@ -155,9 +224,17 @@ def main():
         )
 
     result_file_path = Path(args.result_file)
-    if not result_file_path.parent.exists():
-        result_file_path.parent.mkdir()
-    result_file_path.write_text(html, encoding='utf-8')
+    result_file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Encode once and write the bytes straight to the file descriptor,
+    # bypassing the text and buffering layers of open()
+    payload = memoryview(html.encode('utf-8'))
+    fd = os.open(result_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while payload:
+            payload = payload[os.write(fd, payload):]
+    finally:
+        os.close(fd)
 ##    else:
 ##        parser.error(
 ##            f'Directory "{result_file_path.parent}" can not be created '
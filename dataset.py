@@ -0,0 +1,113 @@
+"""This module defines the load_data() function, which reads the raw data of the
+Wireless Indoor Localization dataset (see README.md for details), and the
+split_by_room() function, which groups the data by room.
+
+The parsed data is cached in a NumPy (.npz) file next to the source file, so that
+subsequent reads skip CSV parsing as long as the source file is unchanged.
+"""
+
+import numpy as np
+import os
+import tempfile
+import zipfile
+
+from pathlib import Path
+
+# Public API declaration
+__all__ = ['load_data', 'split_by_room', 'COLUMNS', 'DTYPE']
+
+COLUMNS = ['d' + str(i) for i in range(1, 8)] + ['room']
+# Signal strength values are small negative integers and rooms are numbered 1 ... 4
+DTYPE = np.int8
+
+def load_data(data_file: str) -> np.ndarray:
+    """Takes a CSV-file with the raw data of the Wi-Fi Localization project (see README.md
+    for details). Returns a 2D array with the columns listed in COLUMNS: d1 ... d7 (signal
+    strength values for each device) and 'room'.
+
+    On the first read, the data is saved to a NumPy file named after 'data_file' with
+    the .cache.npz extension appended (e.g. wifi_localization.txt.cache.npz), together
+    with the size and the modification time of 'data_file'. The NumPy file is used
+    instead of 'data_file' as long as both are unchanged and the cached data is valid.
+    """
+
+    data_file_path = Path(data_file)
+    if not data_file_path.is_file():
+        raise FileNotFoundError(f'File {data_file} can not be found.')
+
+    cache_path = data_file_path.with_name(data_file_path.name + '.cache.npz')
+    # Taken before parsing, so that a source changed meanwhile invalidates the cache
+    data_file_stat = data_file_path.stat()
+    source = np.array([data_file_stat.st_size, data_file_stat.st_mtime_ns], dtype=np.int64)
+
+    if cache_path.is_file():
+        data = _read_cache(cache_path, source)
+        if data is not None:
+            return data
+
+    data = np.loadtxt(data_file, dtype=DTYPE, delimiter='\t', ndmin=2)
+
+    # The cache is optional: a read-only data directory is not an error
+    try:
+        fd, tmp_name = tempfile.mkstemp(suffix='.tmp', dir=cache_path.parent)
+    except OSError:
+        return data
+
+    # The cache is written to a temporary file in the same directory, which then
+    # replaces the cache atomically, so a failed write never leaves a partial cache.
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            np.savez(tmp, data=data, source=source)
+        # mkstemp() creates the file readable by its owner only, give it the mode
+        # open() would, so that the cache is shared by all the users of the data
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_name, 0o666 & ~umask)
+        os.replace(tmp_name, cache_path)
+    except OSError:
+        pass
+    finally:
+        Path(tmp_name).unlink(missing_ok=True)  # nothing left to remove once replaced
+
+    return data
+
+def _read_cache(cache_path: Path, source: np.ndarray) -> np.ndarray | None:
+    """Returns the data cached in 'cache_path', or None if the cache can not be read,
+    was made from a source file with another size or modification time than in
+    'source', or does not hold an array of the expected shape and dtype.
+    """
+
+    try:
+        with np.load(cache_path) as cache:
+            cached_source, data = cache['source'], cache['data']
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        return None
+
+    if (not np.array_equal(cached_source, source)
+            or data.ndim != 2
+            or data.shape[1] != len(COLUMNS)
+            or data.dtype != DTYPE):
+        return None
+
+    return data
+
+def split_by_room(data: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Takes an array as returned by load_data(). Returns a tuple of three arrays:
+
+    rooms: the room numbers, in ascending order.
+
+    signals: the signal strength values (one column per device), with the rows sorted
+    by room, so that the rows of each room are contiguous.
+
+    offsets: the row offsets of the rooms in 'signals', i.e. the rows of rooms[i] are
+    signals[offsets[i]:offsets[i+1]].
+    """
+
+    order = np.argsort(data[:, -1], kind='stable')
+    data = data[order]
+    room, signals = data[:, -1], data[:, :-1]
+
+    # The sorted room column changes value exactly where a new room starts
+    starts = np.flatnonzero(np.r_[True, room[1:] != room[:-1]])
+
+    return room[starts], signals, np.append(starts, len(room))
@@ -5,14 +5,21 @@ Wireless Indoor Localization dataset (see README.md for details).
 The module also features a command line interface.
 """
 
-import pandas as pd
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # no GUI is needed to render the images, including in worker processes
 import matplotlib.pyplot as plt
 import io
+import os
 import zipfile
 
 from pathlib import Path
 from argparse import ArgumentParser
-from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from itertools import chain, repeat
+
+from dataset import load_data, split_by_room
 
 plt.style.use('seaborn-v0_8')
 
@@ -22,9 +29,16 @@ __all__ = ['dist_to_images', 'INPUT_FILE', 'IMAGEDIR', 'IMAGE_STEM', 'BINS'] #,
 INPUT_FILE = 'data/wifi_localization.txt'
 IMAGEDIR = 'data/images'
 IMAGE_STEM = 'room'
-BINS = 20
+BINS = 100
 #FACECOLOUR = '#f2f2f2'
 
+# A single render pass at the resolution implied by the figure size (1024x768),
+# and fast PNG compression. bbox_inches must not be set, as 'tight' renders twice.
+_SAVEFIG_KWARGS = {'format': 'png', 'dpi': 100, 'pil_kwargs': {'compress_level': 1}}
+# Bar colours and legend labels for each of the seven devices
+_COLORS = tuple(f'C{i}' for i in range(7))
+_LEGEND_LABELS = tuple([f'Device {i+1}'] for i in range(7))
+
 def dist_to_images(data_file: str = INPUT_FILE,
                    image_dir: str = IMAGEDIR,
                    image_stem: str = IMAGE_STEM,
@@ -45,75 +59,146 @@ def dist_to_images(data_file: str = INPUT_FILE,
     If default, the resulting files will be named as follows: room_1.png ... room_4.png
     If such files exist, they will be overwritten.
 
-    bins: the number of bins for the plotted distributions (histograms).
+    bins: the maximum number of bins the range of signal strength values of the whole
+    dataset (across all devices and rooms) is split into. The values are whole dBm numbers,
+    so the bins are centred on whole numbers and have a whole-number width: the smallest one
+    that needs no more than 'bins' bins. With the default, each bin holds a single value.
+    The bins are shared by all the plotted distributions (histograms), so each distribution
+    only spans the bins covering its own range of values.
 
     archive: if a name is provided, a zip archive with that name containing the PNG files
     will be saved in 'image_dir', instead of the PNG files. The archive member files will be
     named according to the 'image_stem' rules as described above.
     """
 
-    if not Path(data_file).is_file():
-        raise FileNotFoundError(f'File {data_file} can not be found.')
-    
-    df = pd.read_csv(data_file,
-                     sep = '\t',
-                     header = None,
-                     names  = ['d' + str(i) for i in range(1, 8)] + ['room'],
-                     )
+    rooms, signals, offsets = split_by_room(load_data(data_file))
+
+    # Bin edges are shared by all rooms and devices, so that the counts can be
+    # computed in one pass per room and the bars are aligned across the plots.
+    # They lie halfway between whole numbers, so that every bin holds the same
+    # number of the (integer) values, rather than one or two of them in turn.
+    lo, hi = int(signals.min()), int(signals.max())
+    step = -(-(hi - lo + 1) // bins)  # ceiling division
+    n_bins = -(-(hi - lo + 1) // step)
+    edges = lo - 0.5 + step * np.arange(n_bins + 1)
+
     image_dir_path = Path(image_dir)
-    if not image_dir_path.exists():
-        image_dir_path.mkdir()
+    image_dir_path.mkdir(parents=True, exist_ok=True)
+
+    rooms = rooms.tolist()
+    room_counts = []
+
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        # Digitizing against the inner edges yields bin indices 0 ... n_bins-1
+        idx = np.digitize(signals[start:stop], edges[1:-1])
+        room_counts.append(
+            np.stack([np.bincount(idx[:, d], minlength = n_bins) for d in range(idx.shape[1])])
+            )
+
+    # The rooms are rendered independently, each one in a separate process
+    with ProcessPoolExecutor(max_workers = min(len(rooms), os.cpu_count() or 1)) as executor:
+        results = executor.map(_render_room,
+                               rooms,
+                               room_counts,
+                               repeat(tuple(edges.tolist())),
+                               repeat(image_stem),
+                               repeat(image_dir_path),
+                               repeat(bool(archive)),
+                               )
 
-    if archive:
-        ArchiveMember = namedtuple('ArchiveMember', 'name content')  # PEP 8 UpperCamelCase
-        archive_members: list[ArchiveMember] = []
+        if archive:
+            # Each PNG is streamed into the archive as soon as its room is rendered,
+            # rather than keeping all of them in memory until the last one is ready.
+            # The archive is only created once the first room is rendered, and is
+            # removed if another room fails, so no truncated archive is left behind.
+            archive_path = image_dir_path/archive
+            first_result = next(results)
+            try:
+                with zipfile.ZipFile(file=archive_path,
+                                     mode='w',
+                                     compression=zipfile.ZIP_DEFLATED) as ar:
+                    for image_fname, content in chain([first_result], results):
+                        with ar.open(image_fname, mode='w', force_zip64=True) as member:
+                            member.write(content)
+            except BaseException:
+                archive_path.unlink(missing_ok=True)
+                raise
+        else:
+            list(results)  # re-raises exceptions from the worker processes, if any
 
-    for room in df.room.drop_duplicates():
-        fig, axes = plt.subplots(4, 2,
-                                 figsize = (10.24, 7.68),
-                                 sharex = True,
-                                 sharey = True,
-                                 )
+    return None
 
-        axes = axes.flatten()
-        dfr = df[df.room == room].drop(labels = 'room', axis = 1)
+@cache
+def _get_plot(edges: tuple[float, ...], n_devices: int) -> tuple[plt.Figure, np.ndarray, list]:
+    """Returns the figure used to plot the rooms, its flattened axes and its bar
+    containers: one per device, with a bar for each bin delimited by 'edges'.
+    The figure and the bars are created once per (worker) process and reused for
+    every room rendered by it, only the bar heights being updated.
+    """
 
-        for ax, dev, i in zip(axes, dfr, range(len(dfr.columns))):
-            ax.hist(dfr[dev],
-                    bins = bins,
-                    color = ''.join(('C', str(i))),
-                    )
-            ax.legend([' '.join(('Device ', str(i+1)))], loc='best')
-            #ax.set_facecolor(FACECOLOUR)
+    fig, axes = plt.subplots(4, 2,
+                             figsize = (10.24, 7.68),
+                             sharex = True,
+                             sharey = True,
+                             )
+    axes = axes.flatten()
+    edges = np.array(edges)
+    bars = []
+
+    for ax, i in zip(axes, range(n_devices)):
+        bars.append(
+            ax.bar(edges[:-1],
+                   np.zeros(len(edges) - 1),
+                   width = np.diff(edges),
+                   align = 'edge',
+                   color = _COLORS[i],
+                   )
+            )
+        ax.legend(_LEGEND_LABELS[i], loc='best')
+        #ax.set_facecolor(FACECOLOUR)
+
+    axes[-1].set_visible(False)
+    axes[-3].tick_params(labelbottom=True)
+
+    return fig, axes, bars
+
+def _render_room(room: int,
+                 counts: np.ndarray,
+                 edges: tuple[float, ...],
+                 image_stem: str,
+                 image_dir_path: Path,
+                 archive: bool
+                 ) -> tuple[str, bytes | None]:
+    """Plots the signal strength distributions of one room, given the pre-binned
+    'counts' (one row per device) and the bin 'edges'. Called by dist_to_images()
+    in a worker process.
+
+    Returns: the PNG file name and, if 'archive' is True, the PNG content. Otherwise,
+    the PNG file is saved to 'image_dir_path' and None is returned as the content.
+    """
 
-        axes[-1].set_visible(False)
-        axes[-3].tick_params(labelbottom=True)
-        fig.suptitle(f'Signal strength distribution for each device in Room {room}')
+    fig, axes, bars = _get_plot(edges, len(counts))
 
-        image_fname = ''.join((image_stem, '_', str(room), '.png'))
+    for container, device_counts in zip(bars, counts):
+        for rect, height in zip(container.patches, device_counts):
+            rect.set_height(height)
 
-        if archive:
-            bin_content = io.BytesIO()
-            fig.savefig(bin_content, format='png')
-            archive_members.append(
-                ArchiveMember(
-                    name = image_fname,
-                    content = bin_content.getvalue()
-                    )
-                )
-        else:        
-            fig.savefig(image_dir_path/image_fname, format='png')
-
-        plt.close(fig)
+    # The y axes are shared, and the heights set above are not autoscaled
+    # (5% headroom, as matplotlib's default margins)
+    axes[0].set_ylim(0, max(counts.max(), 1) * 1.05)
+    fig.suptitle(f'Signal strength distribution for each device in Room {room}')
+
+    image_fname = f'{image_stem}_{room}.png'
 
     if archive:
-        with zipfile.ZipFile(file=image_dir_path/archive,
-                             mode='w',
-                             compression=zipfile.ZIP_DEFLATED) as ar:
-            for archive_member in archive_members:
-                ar.writestr(archive_member.name, data=archive_member.content)
+        bin_content = io.BytesIO()
+        fig.savefig(bin_content, **_SAVEFIG_KWARGS)
+        content = bin_content.getvalue()
+    else:
+        fig.savefig(image_dir_path/image_fname, **_SAVEFIG_KWARGS)
+        content = None
 
-    return None
+    return image_fname, content
 
 # CLI
 # ---
@@ -179,7 +264,12 @@ def main():
 
     bins_help_group.add_argument('-b', '--bins',
                         default=BINS,
-                        help=f'The number of bins for each distribution. Defaults to {BINS}.',
+                        help='The maximum number of bins the range of signal strength values of '
+                        'the whole dataset (across all devices and rooms) is split into. The bins '
+                        'are centred on whole dBm values and have the smallest whole-number width '
+                        'that needs no more bins than that. The bins are shared by all the '
+                        'distributions, so each one only spans the bins covering its own range '
+                        f'of values. Defaults to {BINS}, i.e. one value per bin.',
                         type=int,
                         metavar='<number of bins>'
                         )